@@ -2,6 +2,16 @@ from abc import ABCMeta, abstractmethod
 from datetime import datetime
 from enum import Enum
 from getpass import getpass
+import logging
+import subprocess
+
+
+logger = logging.getLogger(__name__)
+
+
+# datetime.fromisoformat() is much faster than strptime(), but it was added in
+# Python 3.7.
+_fromisoformat = getattr(datetime, 'fromisoformat', None)
 
 
 MigrationStatus = Enum(
@@ -27,6 +37,8 @@ MIGRATION_TABLE_SQL = '''
 class Migration():
     ''' Data model for migration metadata. '''
 
+    __slots__ = ('name', 'status', 'started_at', 'completed_at')
+
     def __init__(self, name, status, started_at=None, completed_at=None):
         '''
         Constructor.
@@ -55,6 +67,18 @@ class Migration():
         elif isinstance(dt, datetime):
             return dt
         elif isinstance(dt, str):
+            if _fromisoformat is not None:
+                # Before Python 3.11, fromisoformat() only accepts 3 or 6
+                # digit fractions. From 3.11, it also accepts time zones, but
+                # timestamps are stored without one, so those are left for
+                # strptime() to reject.
+                try:
+                    parsed = _fromisoformat(dt)
+                except ValueError:
+                    pass
+                else:
+                    if parsed.tzinfo is None:
+                        return parsed
             try:
                 # ISO SQL date:
                 return datetime.strptime(dt, '%Y-%m-%d %H:%M:%S.%f')
@@ -134,18 +158,25 @@ def create_backend(db_type, host, port, user, password, database, schema):
 class AbstractBackend(metaclass=ABCMeta):
     ''' Base class for Agnostic backends. '''
 
+    # The DB-API parameter placeholder and the SQL function that returns the
+    # current timestamp. Subclasses override these to match their database.
+    _param = '%s'
+    _now_fn = 'NOW()'
+
+    # The maximum number of rows in each INSERT sent by
+    # ``bootstrap_migrations()``. Each row takes two parameters, and SQLite
+    # allows at most 999 parameters in one statement.
+    _bootstrap_batch_size = 400
+
     @property
     def location(self):
-        schema = '' if self._schema is None else ' schema={}'.format(
-            self._schema)
-        location = 'database [{}{}]'.format(self._database, schema)
-        return location
+        ''' A description of the database, for use in messages. '''
+
+        return self._location
 
     def __init__(self, host, port, user, password, database, schema):
         ''' Constructor. '''
 
-        self._param = '%s'
-        self._now_fn = 'NOW()'
         self._host = host
         self._port = port
         self._user = user
@@ -153,6 +184,38 @@ class AbstractBackend(metaclass=ABCMeta):
         self._database = database
         self._schema = schema
 
+        # The environment for command line tools started by ``_popen()``.
+        # None means the tools inherit this process's environment.
+        self._env = None
+
+        if schema is None:
+            self._location = 'database [{}]'.format(database)
+        else:
+            self._location = 'database [{} schema={}]'.format(database, schema)
+
+        # The SQL for reading and writing migration metadata only depends on
+        # the placeholder and timestamp function, so build it once here
+        # rather than on every call.
+        self._bootstrap_row_sql = '({}, {}, {}, {})'.format(
+            self._param, self._param, self._now_fn, self._now_fn)
+
+        self._has_failed_sql = '''
+            SELECT 1 FROM agnostic_migrations
+            WHERE status = {}
+            LIMIT 1
+        '''.format(self._param)
+
+        self._migration_started_sql = '''
+            INSERT INTO agnostic_migrations (name, status, started_at)
+            VALUES ({}, {}, {})
+        '''.format(self._param, self._param, self._now_fn)
+
+        self._migration_succeeded_sql = '''
+            UPDATE agnostic_migrations
+               SET status = {}, completed_at = {}
+             WHERE name = {}
+        '''.format(self._param, self._now_fn, self._param)
+
     @abstractmethod
     def backup_db(self, backup_file):
         '''
@@ -168,10 +231,6 @@ class AbstractBackend(metaclass=ABCMeta):
     def connect_db(self):
         ''' Return a database connection. '''
 
-    @abstractmethod
-    def get_schema_command(self):
-        ''' Get a command for setting the current schema. '''
-
     @abstractmethod
     def restore_db(self, backup_file):
         '''
@@ -195,15 +254,40 @@ class AbstractBackend(metaclass=ABCMeta):
         messages, if any.
         '''
 
-    def bootstrap_migration(self, cursor, migration_name):
+    def _popen(self, command, **kwargs):
         '''
-        Insert a row into the migration table with the 'bootstrapped' status.
+        Return a ``Popen`` instance that runs ``command`` in this backend's
+        tool environment, with stderr connected to a pipe so that callers can
+        report errors. Any ``kwargs`` are passed through to ``Popen``.
         '''
-        print('BOOTSTRAP {}'.format(migration_name))
-        sql = 'INSERT INTO agnostic_migrations VALUES ({}, {}, {}, {})'.format(
-            self._param, self._param, self._now_fn, self._now_fn)
-        print(sql)
-        cursor.execute(sql, (migration_name, MigrationStatus.bootstrapped.name))
+
+        return subprocess.Popen(
+            command,
+            env=self._env,
+            stderr=subprocess.PIPE,
+            **kwargs
+        )
+
+    def bootstrap_migrations(self, cursor, migration_names):
+        '''
+        Insert a row into the migration table with the 'bootstrapped' status
+        for each of the specified migrations.
+
+        The rows are sent as multi-row INSERT statements of up to
+        ``_bootstrap_batch_size`` rows each, rather than one statement per
+        migration. Not every driver batches ``executemany()`` on its own.
+        '''
+        params = list()
+        for migration_name in migration_names:
+            logger.debug('Bootstrap %s', migration_name)
+            params.append((migration_name, MigrationStatus.bootstrapped.name))
+        batch_size = self._bootstrap_batch_size
+        for start in range(0, len(params), batch_size):
+            batch = params[start:start + batch_size]
+            sql = 'INSERT INTO agnostic_migrations VALUES {}'.format(
+                ', '.join([self._bootstrap_row_sql] * len(batch)))
+            logger.debug('Execute %s', sql)
+            cursor.execute(sql, [value for row in batch for value in row])
 
     def create_migrations_table(self, cursor):
         ''' Create the migrations table. '''
@@ -225,7 +309,25 @@ class AbstractBackend(metaclass=ABCMeta):
         '''
 
         cursor.execute(query)
-        return [Migration(*row) for row in cursor.fetchall()]
+        return [Migration(*row) for row in cursor]
+
+    def get_migration_names(self, cursor):
+        '''
+        Get the names of the migrations in the database, in the same order as
+        ``get_migration_records()``.
+
+        This is cheaper than ``get_migration_records()`` for callers that
+        don't need the status or timestamps.
+        '''
+
+        query = '''
+            SELECT name
+              FROM agnostic_migrations
+          ORDER BY started_at, name
+        '''
+
+        cursor.execute(query)
+        return [row[0] for row in cursor]
 
     def get_schema_command(self):
         ''' Return a command that will set schema. This is a no-op by default
@@ -238,13 +340,8 @@ class AbstractBackend(metaclass=ABCMeta):
         Return True if there are any failed migrations, or False otherwise.
         '''
 
-        query = '''
-            SELECT COUNT(*) FROM agnostic_migrations
-            WHERE status LIKE {};
-        '''.format(self._param)
-
-        cursor.execute(query, (MigrationStatus.failed.name,))
-        return cursor.fetchone()[0] != 0
+        cursor.execute(self._has_failed_sql, (MigrationStatus.failed.name,))
+        return cursor.fetchone() is not None
 
     def migration_started(self, cursor, migration):
         '''
@@ -256,12 +353,10 @@ class AbstractBackend(metaclass=ABCMeta):
         metadata is updated (in ``migration_succeeded()``) to reflect that.
         '''
 
-        sql = '''
-            INSERT INTO agnostic_migrations (name, status, started_at)
-            VALUES ({}, {}, {})
-        '''.format(self._param, self._param, self._now_fn)
-
-        cursor.execute(sql, [migration.name, MigrationStatus.failed.name])
+        cursor.execute(
+            self._migration_started_sql,
+            [migration.name, MigrationStatus.failed.name]
+        )
 
     def migration_succeeded(self, cursor, migration):
         '''
@@ -269,23 +364,22 @@ class AbstractBackend(metaclass=ABCMeta):
         finished successfully.
         '''
 
-        sql = '''
-            UPDATE agnostic_migrations
-               SET status = {}, completed_at = {}
-             WHERE name = {}
-        '''.format(self._param, self._now_fn, self._param)
-
-        cursor.execute(sql, [MigrationStatus.succeeded.name, migration.name])
+        cursor.execute(
+            self._migration_succeeded_sql,
+            [MigrationStatus.succeeded.name, migration.name]
+        )
 
     def write_migration_inserts(self, cursor, outfile):
         ''' Write SQL for inserting migration metadata to `outfile`. '''
 
         outfile.write(self.get_schema_command())
+
+        # Only the name varies between rows, so fill in everything else once.
         insert_sql = (
             "INSERT INTO agnostic_migrations VALUES "
-            "('{}', '{}', {}, {});\n"
-        )
+            "('{{}}', '{}', {}, {});\n"
+        ).format(MigrationStatus.succeeded.name, self._now_fn, self._now_fn)
 
-        for migration in self.get_migration_records(cursor):
-            outfile.write(insert_sql.format(migration.name,
-                MigrationStatus.succeeded.name, self._now_fn, self._now_fn))
+        # Names are file paths, so quote them as SQL string literals.
+        outfile.writelines(insert_sql.format(name.replace("'", "''"))
+            for name in self.get_migration_names(cursor))
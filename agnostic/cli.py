@@ -1,11 +1,11 @@
 from contextlib import contextmanager
-from datetime import datetime
-import difflib
+import io
+import locale
+import logging
 import os
-import tempfile
+import subprocess
 
 import click
-import sqlparse
 
 from agnostic import create_backend, Migration, MigrationStatus
 
@@ -15,13 +15,37 @@ class Config(object):
 
     def __init__(self):
         self.backend = None
+        self.db = None
         self.debug = False
         self.migrations_dir = None
+        self._migration_files = None
+
+    @property
+    def migration_files(self):
+        '''
+        The names of the migration files in ``migrations_dir``.
+
+        The directory is only walked the first time this is accessed.
+        '''
+
+        if self._migration_files is None:
+            self._migration_files = _list_migration_files(self.migrations_dir)
+
+        return self._migration_files
 
 
 pass_config = click.make_pass_decorator(Config, ensure=True)
 
 
+# The color used to display each migration status in ``list``.
+_STATUS_COLORS = {
+    MigrationStatus.bootstrapped: None,
+    MigrationStatus.failed: 'red',
+    MigrationStatus.pending: None,
+    MigrationStatus.succeeded: 'green',
+}
+
+
 @click.group()
 @click.option(
     '-t', '--db-type',
@@ -82,7 +106,8 @@ pass_config = click.make_pass_decorator(Config, ensure=True)
 @click.option(
     '-D', '--debug',
     is_flag=True,
-    help='Display stack traces when exceptions occur.'
+    help='Display stack traces when exceptions occur, and log debug '
+         'messages (such as the SQL that bootstrap runs) to stderr.'
 )
 @click.version_option()
 @pass_config
@@ -93,6 +118,10 @@ def main(config, db_type, host, port, user, password, database, schema,
     config.debug = debug
     config.migrations_dir = migrations_dir
 
+    if debug:
+        _enable_debug_logging()
+    click.get_current_context().call_on_close(lambda: _close_db(config))
+
     try:
         config.backend = create_backend(db_type, host, port, user, password,
                                         database, schema)
@@ -127,14 +156,14 @@ def bootstrap(config, load_existing):
             raise click.ClickException(msg.format(e))
 
         if load_existing:
-            for migration in _list_migration_files(config.migrations_dir):
-                try:
-                    config.backend.bootstrap_migration(cursor, migration)
-                except Exception as e:
-                    if config.debug:
-                        raise
-                    msg = 'Failed to load existing migrations: '
-                    raise click.ClickException(msg + str(e)) from e
+            try:
+                config.backend.bootstrap_migrations(cursor,
+                                                    config.migration_files)
+            except Exception as e:
+                if config.debug:
+                    raise
+                msg = 'Failed to load existing migrations: '
+                raise click.ClickException(msg + str(e)) from e
 
     click.secho('Migration table created.', fg='green')
 
@@ -210,51 +239,69 @@ def list_(config):
                 raise click.ClickException('No migrations exist.')
 
             column_names = 'Name', 'Status', 'Started At', 'Completed At'
-            max_name = max([len(m.name) for m in migrations])
-            max_status = max([len(m.status.name) for m in migrations])
+            max_name = max_status = 0
+
+            for migration in migrations:
+                if len(migration.name) > max_name:
+                    max_name = len(migration.name)
+                if len(migration.status.name) > max_status:
+                    max_status = len(migration.status.name)
+
             row_format = '{{:<{}}} | {{:{}}} | {{:<19}} | {{:<19}}'
             name_col_width = max(max_name, len(column_names[1]))
             status_col_width = max(max_status, len(column_names[2]))
-            row = row_format.format(name_col_width, status_col_width)
-            date_format = '%Y-%m-%d %H:%I:%S'
+            table_row_format = row_format.format(name_col_width,
+                                                 status_col_width)
+            format_row = table_row_format.format
 
-            click.echo(row.format(*column_names))
-            click.echo(
+            # Style each status's row format once, instead of styling every
+            # row as it is printed.
+            status_formats = dict()
+
+            for status, color in _STATUS_COLORS.items():
+                if color is None:
+                    status_formats[status] = format_row
+                else:
+                    status_formats[status] = \
+                        click.style(table_row_format, fg=color).format
+
+            # Build the whole table first and write it with one echo() call
+            # instead of one call (and flush) per row.
+            lines = [
+                format_row(*column_names),
                 '-' * (name_col_width + 1) + '+' +
                 '-' * (status_col_width + 2) + '+' +
                 '-' * 21 + '+' +
-                '-' * 20
-            )
+                '-' * 20,
+            ]
 
             for migration in migrations:
                 if migration.started_at is None:
                     started_at = 'N/A'
                 else:
-                    started_at = migration.started_at.strftime(date_format)
+                    started_at = str(
+                        migration.started_at.replace(microsecond=0))
 
                 if migration.completed_at is None:
                     completed_at = 'N/A'
-                elif isinstance(migration.completed_at, datetime):
-                    completed_at = migration.completed_at.strftime(date_format)
+                else:
+                    completed_at = str(
+                        migration.completed_at.replace(microsecond=0))
 
-                msg = row.format(
+                try:
+                    format_status_row = status_formats[migration.status]
+                except KeyError:
+                    msg = 'Invalid migration status: "{}".'
+                    raise ValueError(msg.format(migration.status.name))
+
+                lines.append(format_status_row(
                     migration.name,
                     migration.status.name,
                     started_at,
                     completed_at
-                )
-
-                if migration.status == MigrationStatus.bootstrapped:
-                    click.echo(msg)
-                elif migration.status == MigrationStatus.failed:
-                    click.secho(msg, fg='red')
-                elif migration.status == MigrationStatus.pending:
-                    click.echo(msg)
-                elif migration.status == MigrationStatus.succeeded:
-                    click.secho(msg, fg='green')
-                else:
-                    msg = 'Invalid migration status: "{}".'
-                    raise ValueError(msg.format(migration.status.name))
+                ))
+
+            click.echo('\n'.join(lines))
 
         except Exception as e:
             if config.debug:
@@ -287,20 +334,21 @@ def migrate(config, backup):
             msg = 'Cannot run due to previously failed migrations.'
             raise click.ClickException(click.style(msg, fg='red'))
 
-        _, pending = _get_all_migrations(config, cursor)
+        pending = _get_pending_migrations(config, cursor)
         total = len(pending)
 
         if total == 0:
             click.secho('There are no pending migrations.', fg='red')
             return
 
-    # Make a backup file [optional].
+    # Make a backup file [optional]. The file stays open so that it can be
+    # rewound and handed to the restore tool without reopening it.
     if backup:
-        backup_file = tempfile.NamedTemporaryFile('w', delete=False)
+        import tempfile
+        backup_file = tempfile.NamedTemporaryFile('w+', delete=False)
         msg = 'Backing up {} to "{}".'
         click.echo(msg.format(config.backend.location, backup_file.name))
         _wait_for(config.backend.backup_db(backup_file))
-        backup_file.close()
 
     # Run migrations.
     with _get_db_cursor(config) as (db, cursor):
@@ -318,11 +366,11 @@ def migrate(config, backup):
             if backup:
                 click.secho('Will try to restore from backup…', fg='red')
                 config.backend.clear_db(cursor)
-                db.close()
+                _close_db(config)
 
                 try:
-                    with open(backup_file.name, 'r') as backup_handle:
-                        _wait_for(config.backend.restore_db(backup_handle))
+                    backup_file.seek(0)
+                    _wait_for(config.backend.restore_db(backup_file))
                     click.secho('Restored from backup.', fg='green')
                 except Exception as e2:
                     msg = 'Could not restore from backup: {}'.format(e2)
@@ -339,6 +387,7 @@ def migrate(config, backup):
     # Remove backup file.
     if backup:
         click.echo('Removing backup "{}".'.format(backup_file.name))
+        backup_file.close()
         os.unlink(backup_file.name)
 
 
@@ -392,9 +441,6 @@ def test(config, yes, current, target):
     without disrupting your development work.
     '''
 
-    # Create a temporary file for holding the migrated database.
-    temp_snapshot = tempfile.TemporaryFile('w+')
-
     # Make sure the user understands what is about to happen.
     warning = (
         'WARNING: This will drop all objects in {}!'
@@ -417,7 +463,7 @@ def test(config, yes, current, target):
 
     with _get_db_cursor(config) as (db, cursor):
         # Run migrations on current database structure.
-        _, pending = _get_all_migrations(config, cursor)
+        pending = _get_pending_migrations(config, cursor)
         total = len(pending)
         click.echo(
             'About to run {} migration{} in {}:'
@@ -433,33 +479,45 @@ def test(config, yes, current, target):
 
         click.echo('Finished migrations.')
 
-    # Dump the migrated database structure to the temp file.
+    # Read the migrated database structure directly from the snapshot tool's
+    # output, followed by the same migration metadata that ``snapshot``
+    # writes.
     click.echo('Snapshotting the migrated database.')
-    _wait_for(config.backend.snapshot_db(temp_snapshot))
+    ignore = 'INSERT INTO agnostic_migrations'
+    process = config.backend.snapshot_db(subprocess.PIPE)
+    # Decode and split the output the same way that the text-mode ``target``
+    # file is read: with the locale's encoding and universal newlines.
+    encoding = locale.getpreferredencoding(False)
+    snapshot = io.StringIO(_wait_for(process).decode(encoding), newline=None)
+    migrated = [line for line in snapshot if not line.startswith(ignore)]
+
+    migration_inserts = io.StringIO()
     with _get_db_cursor(config) as (db, cursor):
-        config.backend.write_migration_inserts(cursor, temp_snapshot)
+        config.backend.write_migration_inserts(cursor, migration_inserts)
+    migration_inserts.seek(0)
+    migrated.extend(line for line in migration_inserts
+                    if not line.startswith(ignore))
 
     # Compare the migrated database structure to the target database structure.
     click.echo('Comparing migrated database to target database.')
-    temp_snapshot.seek(0)
-
-    ignore = 'INSERT INTO agnostic_migrations'
-    migrated = [line for line in temp_snapshot if not line.startswith(ignore)]
     targeted = [line for line in target if not line.startswith(ignore)]
 
-    diff = list(difflib.unified_diff(
-        migrated,
-        targeted,
-        fromfile='Migrated DB',
-        tofile='Target DB'
-    ))
-
-    if len(diff) == 0:
+    # Comparing the lists is linear, while computing a diff is not, so only
+    # compute a diff when the snapshots are known to differ.
+    if migrated == targeted:
         click.secho(
             'Test passed: migrated database matches target database!',
             fg='green'
         )
     else:
+        import difflib
+        diff = difflib.unified_diff(
+            migrated,
+            targeted,
+            fromfile='Migrated DB',
+            tofile='Target DB'
+        )
+
         click.secho(
             'Test failed: migrated database differs from target database.\n',
             fg='red'
@@ -478,35 +536,74 @@ main.add_command(migrate)
 
 @contextmanager
 def _get_db_cursor(config):
-    ''' Return a database handle and cursor. '''
+    '''
+    Return a database handle and cursor.
 
-    try:
-        db = config.backend.connect_db()
-    except Exception as e:
-        if config.debug:
-            raise
-        msg = 'Cannot connect to database: {}'
-        raise click.ClickException(msg.format(e))
+    The database connection is opened the first time this is called for a
+    given ``config`` and reused by later calls, so that a command does not
+    reconnect for every step. The schema is set once, when the connection is
+    opened. The cursor is closed on exit, but the connection stays open until
+    ``_close_db()`` is called.
+    '''
+
+    new_connection = config.db is None
 
+    if new_connection:
+        try:
+            config.db = config.backend.connect_db()
+        except Exception as e:
+            if config.debug:
+                raise
+            msg = 'Cannot connect to database: {}'
+            raise click.ClickException(msg.format(e))
+
+    db = config.db
     cursor = db.cursor()
 
-    try:
-        cursor.execute(config.backend.get_schema_command())
-    except Exception as e:
-        if config.debug:
-            raise
-        msg = 'Cannot set schema: {}'
-        raise click.ClickException(msg.format(e))
+    if new_connection:
+        try:
+            cursor.execute(config.backend.get_schema_command())
+        except Exception as e:
+            # Don't keep a connection that has no schema set: later calls
+            # would reuse it without trying to set the schema again.
+            _close_db(config)
+            if config.debug:
+                raise
+            msg = 'Cannot set schema: {}'
+            raise click.ClickException(msg.format(e))
 
     try:
         yield db, cursor
     finally:
         try:
-            db.close()
+            cursor.close()
         except:
             pass
 
 
+def _enable_debug_logging():
+    ''' Send the ``agnostic`` package's debug log messages to stderr. '''
+
+    logger = logging.getLogger('agnostic')
+    logger.setLevel(logging.DEBUG)
+
+    # Don't add a second handler if the CLI runs more than once in a process.
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+
+
+def _close_db(config):
+    ''' Close the connection opened by ``_get_db_cursor()``, if any. '''
+
+    if config.db is not None:
+        try:
+            config.db.close()
+        except:
+            pass
+
+        config.db = None
+
+
 def _get_all_migrations(config, cursor):
     '''
     Returns a list of all applied migrations and a list of all pending
@@ -522,13 +619,36 @@ def _get_all_migrations(config, cursor):
 
     applied = config.backend.get_migration_records(cursor)
     applied_set = {migration.name for migration in applied}
+    pending = _filter_pending_migrations(config, applied_set)
+    return applied, pending
+
+
+def _get_pending_migrations(config, cursor):
+    '''
+    Returns a list of all pending migrations, in the order that they should be
+    applied.
+
+    This is the same as the second list returned by ``_get_all_migrations()``,
+    but only the names of applied migrations are fetched from the database.
+    '''
+
+    applied_set = set(config.backend.get_migration_names(cursor))
+    return _filter_pending_migrations(config, applied_set)
+
+
+def _filter_pending_migrations(config, applied_set):
+    '''
+    Returns a list of the migration files whose names are not in
+    ``applied_set``, in the order that they should be applied.
+    '''
+
     pending = list()
 
-    for migration_name in _list_migration_files(config.migrations_dir):
+    for migration_name in config.migration_files:
         if migration_name not in applied_set:
             pending.append(Migration(migration_name, MigrationStatus.pending))
 
-    return applied, pending
+    return pending
 
 
 def _list_migration_files(migrations_dir):
@@ -540,25 +660,43 @@ def _list_migration_files(migrations_dir):
     order.
     '''
 
-    def helper(sub_path):
-        migration_prefix_len = len(migrations_dir) + 1
-        current_dir = os.path.join(migrations_dir, sub_path)
+    migration_prefix_len = len(migrations_dir) + 1
+    migrations = list()
+
+    def sorted_entries(current_dir):
+        # Directory entries from scandir() carry the file type, so is_file()
+        # and is_dir() usually don't need an extra stat() per entry. The
+        # scandir() iterator is exhausted by sorted(), which closes it; it is
+        # not used as a context manager because that requires Python 3.6.
+        dir_entries = sorted(os.scandir(current_dir),
+                             key=lambda e: e.name.upper())
+        return iter(dir_entries)
+
+    # Walk the tree depth first with an explicit stack of entry iterators, so
+    # that a subdirectory's migrations are listed in place of the directory.
+    stack = [sorted_entries(migrations_dir)]
+
+    while stack:
+        for dir_entry in stack[-1]:
+            if dir_entry.name.endswith('.sql') and dir_entry.is_file():
+                migrations.append(dir_entry.path[migration_prefix_len:-4])
+            elif dir_entry.is_dir():
+                stack.append(sorted_entries(dir_entry.path))
+                break
+        else:
+            stack.pop()
 
-        for dir_entry in sorted(os.listdir(current_dir), key=str.upper):
-            dir_entry_path = os.path.join(current_dir, dir_entry)
-
-            if os.path.isfile(dir_entry_path) and dir_entry.endswith('.sql'):
-                yield dir_entry_path[migration_prefix_len:-4]
-            elif os.path.isdir(dir_entry_path):
-                new_sub_path = os.path.join(sub_path, dir_entry)
-                yield from helper(new_sub_path)
-
-    migrations = list(helper(''))
     return migrations
 
 
 def _run_migrations(config, cursor, migrations):
-    ''' Run the specified migrations in the given order. '''
+    '''
+    Run the specified migrations in the given order.
+
+    All migration scripts are read before the first one is started, so that
+    an unreadable script is reported before the database is modified and so
+    that no file I/O happens between updates to the migration metadata.
+    '''
 
     total = len(migrations)
 
@@ -568,16 +706,19 @@ def _run_migrations(config, cursor, migrations):
             '{}.sql'.format(migration.name)
         )
 
-    for index, migration in enumerate(migrations):
+    scripts = list()
+
+    for migration in migrations:
+        with open(mig2file(migration), 'r') as migration_file:
+            scripts.append(migration_file.read())
+
+    for index, (migration, script) in enumerate(zip(migrations, scripts)):
         msg = ' * Running migration {} ({}/{})'
         msg_args = click.style(migration.name, bold=True), index + 1, total
         click.echo(msg.format(*msg_args))
 
         config.backend.migration_started(cursor, migration)
-
-        with open(mig2file(migration), 'r') as migration_file:
-            _run_sql(cursor, migration_file.read())
-
+        _run_sql(cursor, script)
         config.backend.migration_succeeded(cursor, migration)
 
 
@@ -587,18 +728,31 @@ def _run_sql(cursor, sql):
 
     This breaks up the block into individual statements so that database
     drivers that don't support query stacking (multiple queries at once)
-    won't break.
+    won't break. Statements are parsed lazily, so each one is executed as
+    soon as it has been parsed and only one parse tree is held at a time.
     '''
 
-    for statement in sqlparse.parse(sql):
+    # sqlparse is only needed by commands that run migrations, so it is
+    # imported here rather than on every start of the CLI.
+    import sqlparse
+
+    for statement in sqlparse.parsestream(sql):
         if statement.get_type() != 'UNKNOWN':
             cursor.execute(str(statement))
 
 
 def _wait_for(process):
-    ''' Wait for ``process`` to finish and check the exit code. '''
+    '''
+    Wait for ``process`` to finish, check the exit code, and return its
+    stdout (``None`` unless stdout is a pipe).
 
-    process.wait()
+    This is the only place that reads from the process's pipes. Stdout and
+    stderr are drained together while waiting, because a tool that fills
+    either pipe buffer would otherwise block forever. Callers must not read
+    from ``process.stdout`` themselves.
+    '''
+
+    stdout, stderr = process.communicate()
 
     if process.returncode != 0:
         msg = 'failed to run external tool "{}" (exit {}):\n{}'
@@ -606,11 +760,13 @@ def _wait_for(process):
         params = (
             process.args[0],
             process.returncode,
-            process.stderr.read().decode('utf8', errors='replace')
+            stderr.decode('utf8', errors='replace')
         )
 
         raise click.ClickException(msg.format(*params))
 
+    return stdout
+
 
 if __name__ == '__main__': #pragma no cover
     main()
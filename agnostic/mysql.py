@@ -9,36 +9,23 @@ from agnostic import AbstractBackend
 class MysqlBackend(AbstractBackend):
     ''' Support for MySQL. '''
 
+    def __init__(self, *args):
+        ''' Constructor. '''
+
+        super().__init__(*args)
+        self._env = dict(os.environ, MYSQL_PWD=self._password)
+
     def backup_db(self, backup_file):
         '''
         Return a ``Popen`` instance that will backup the database to the
         ``backup_file`` handle.
         '''
 
-        env = {'MYSQL_PWD': self._password}
-        env.update(os.environ)
-
-        command = [
-            'mysqldump',
-            '-h', self._host,
-            '-u', self._user,
-        ]
-
-        if self._port is not None:
-            command.append('-P')
-            command.append(str(self._port))
-
-        command.append(self._database)
-
-        process = subprocess.Popen(
-            command,
-            env=env,
-            stdout=backup_file,
-            stderr=subprocess.PIPE
+        return self._popen(
+            self._command('mysqldump', []),
+            stdout=backup_file
         )
 
-        return process
-
     def clear_db(self, cursor):
         ''' Remove all objects from the database. '''
 
@@ -80,59 +67,46 @@ class MysqlBackend(AbstractBackend):
         ``backup_file`` handle.
         '''
 
-        env = {'MYSQL_PWD': self._password}
-        env.update(os.environ)
-
-        command = [
-            'mysql',
-            '-h', self._host,
-            '-u', self._user,
-        ]
-
-        if self._port is not None:
-            command.append('-P')
-            command.append(str(self._port))
-
-        command.append(self._database)
-
-        process = subprocess.Popen(
-            command,
-            env=env,
+        return self._popen(
+            self._command('mysql', []),
             stdin=backup_file,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE
+            stdout=subprocess.DEVNULL
         )
 
-        return process
-
     def snapshot_db(self, snapshot_file):
         '''
         Return a ``Popen`` instance that writes a snapshot to ``snapshot_file``.
         '''
 
-        env = {'MYSQL_PWD': self._password}
-        env.update(os.environ)
+        options = [
+            '--no-create-db',
+            '--no-data',
+            '--compact',
+        ]
+
+        return self._popen(
+            self._command('mysqldump', options),
+            stdout=snapshot_file
+        )
+
+    def _command(self, tool, options):
+        '''
+        Return the argument list for running the MySQL command line ``tool``
+        with ``options`` against this database.
+        '''
 
         command = [
-            'mysqldump',
+            tool,
             '-h', self._host,
             '-u', self._user,
-            '--no-create-db',
-            '--no-data',
-            '--compact',
         ]
 
+        command.extend(options)
+
         if self._port is not None:
             command.append('-P')
             command.append(str(self._port))
 
         command.append(self._database)
 
-        process = subprocess.Popen(
-            command,
-            env=env,
-            stdout=snapshot_file,
-            stderr=subprocess.PIPE
-        )
-
-        return process
+        return command
@@ -9,87 +9,69 @@ from agnostic import AbstractBackend
 class PostgresBackend(AbstractBackend):
     ''' Support for PostgreSQL. '''
 
+    def __init__(self, *args):
+        ''' Constructor. '''
+
+        super().__init__(*args)
+        self._env = dict(os.environ, PGPASSWORD=self._password)
+
     def backup_db(self, backup_file):
         '''
         Return a ``Popen`` instance that will backup the database to the
         ``backup_file`` handle.
         '''
 
-        env = {'PGPASSWORD': self._password}
-        env.update(os.environ)
-
-        command = [
-            'pg_dump',
-            '-h', self._host,
-            '-U', self._user,
-        ]
-
-        if self._port is not None:
-            command.append('-p')
-            command.append(str(self._port))
-
-        for schema in self._split_schema():
-            command.append('-n')
-            command.append(schema)
-
-        command.append(self._database)
-
-        process = subprocess.Popen(
-            command,
-            env=env,
-            stdout=backup_file,
-            stderr=subprocess.PIPE
+        return self._popen(
+            self._command('pg_dump', [], self._split_schema()),
+            stdout=backup_file
         )
 
-        return process
-
     def clear_db(self, cursor):
         ''' Remove all objects from the database. '''
 
-        # Drop tables.
-        cursor.execute('''
-            SELECT schemaname, tablename FROM pg_tables
-             WHERE tableowner = %s
-               AND schemaname != 'pg_catalog'
-               AND schemaname != 'information_schema'
-        ''', (self._user,))
-
-        tables = ['"{}"."{}"'.format(r[0], r[1]) for r in cursor.fetchall()]
-
-        if len(tables) > 0:
-            sql = 'DROP TABLE {} CASCADE'.format(', '.join(tables))
-            cursor.execute(sql)
-
-        # Drop sequences.
-        cursor.execute('''
-            SELECT relname FROM pg_class
-             WHERE relkind = 'S'
-        ''')
-
-        sequences = ['"{}"'.format(row[0]) for row in cursor.fetchall()]
-
-        if len(sequences) > 0:
-            sql = 'DROP SEQUENCE {} CASCADE'.format(','.join(sequences))
-            cursor.execute(sql)
-
-        # Drop custom types, e.g. ENUM types.
+        # Drop tables, sequences, and custom types (e.g. ENUM types). The
+        # DROP statements are generated and executed on the server so that
+        # this takes one round trip regardless of how many objects exist.
         cursor.execute('''
-            SELECT typname FROM pg_type
-             WHERE typtype = 'e'
+            DO $$
+            DECLARE
+                r RECORD;
+            BEGIN
+                FOR r IN SELECT schemaname, tablename FROM pg_tables
+                          WHERE tableowner = current_user
+                            AND schemaname != 'pg_catalog'
+                            AND schemaname != 'information_schema'
+                LOOP
+                    EXECUTE 'DROP TABLE IF EXISTS '
+                        || quote_ident(r.schemaname) || '.'
+                        || quote_ident(r.tablename) || ' CASCADE';
+                END LOOP;
+
+                FOR r IN SELECT relname FROM pg_class WHERE relkind = 'S'
+                LOOP
+                    EXECUTE 'DROP SEQUENCE IF EXISTS '
+                        || quote_ident(r.relname) || ' CASCADE';
+                END LOOP;
+
+                FOR r IN SELECT typname FROM pg_type WHERE typtype = 'e'
+                LOOP
+                    EXECUTE 'DROP TYPE IF EXISTS '
+                        || quote_ident(r.typname) || ' CASCADE';
+                END LOOP;
+            END
+            $$
         ''')
 
-        types = ['"{}"'.format(row[0]) for row in cursor.fetchall()]
-
-        if len(types) > 0:
-            sql = 'DROP TYPE {} CASCADE'.format(','.join(types))
+        # Drop schema objects. DROP SCHEMA accepts a list of names, so all of
+        # the schemas are dropped with one statement. The names are used as
+        # given, the same way that ``get_schema_command()`` and ``pg_dump -n``
+        # use them.
+        schemas = [schema for schema in self._split_schema()
+                   if schema != 'public']
+        if len(schemas) > 0:
+            sql = 'DROP SCHEMA IF EXISTS {} CASCADE'.format(', '.join(schemas))
             cursor.execute(sql)
 
-        # Drop schema objects.
-        for schema in self._split_schema():
-            if schema != 'public':
-                sql = 'DROP SCHEMA IF EXISTS {} CASCADE'.format(schema)
-                cursor.execute(sql)
-
     def connect_db(self):
         ''' Connect to PostgreSQL. '''
 
@@ -124,68 +106,56 @@ class PostgresBackend(AbstractBackend):
         ``backup_file`` handle.
         '''
 
-        env = {'PGPASSWORD': self._password}
-        env.update(os.environ)
-
-        command = [
-            'psql',
-            '-h', self._host,
-            '-U', self._user,
-            '-v', 'ON_ERROR_STOP=1', # Fail fast if an error occurs.
-        ]
-
-        if self._port is not None:
-            command.append('-p')
-            command.append(str(self._port))
-
-        command.append(self._database)
-
-        process = subprocess.Popen(
-            command,
-            env=env,
+        return self._popen(
+            # Fail fast if an error occurs.
+            self._command('psql', ['-v', 'ON_ERROR_STOP=1'], []),
             stdin=backup_file,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE
+            stdout=subprocess.DEVNULL
         )
 
-        return process
-
     def snapshot_db(self, snapshot_file):
         '''
         Return a ``Popen`` instance that writes a snapshot to ``snapshot_file``.
         '''
 
-        env = {'PGPASSWORD': self._password}
-        env.update(os.environ)
-
-        command = [
-            'pg_dump',
-            '-h', self._host,
-            '-U', self._user,
+        options = [
             '-s', # dump schema only
             '-x', # don't dump grant/revoke statements
             '-O', # don't dump ownership commands
             '--no-tablespaces',
         ]
 
+        return self._popen(
+            self._command('pg_dump', options, self._split_schema()),
+            stdout=snapshot_file
+        )
+
+    def _command(self, tool, options, schemas):
+        '''
+        Return the argument list for running the PostgreSQL command line
+        ``tool`` with ``options`` against this database, limited to
+        ``schemas`` (if any).
+        '''
+
+        command = [
+            tool,
+            '-h', self._host,
+            '-U', self._user,
+        ]
+
+        command.extend(options)
+
         if self._port is not None:
             command.append('-p')
             command.append(str(self._port))
 
-        if self._schema is not None:
-            for schema in self._split_schema():
-                command.extend(('-n', schema))
+        for schema in schemas:
+            command.append('-n')
+            command.append(schema)
 
         command.append(self._database)
 
-        process = subprocess.Popen(
-            command,
-            env=env,
-            stdout=snapshot_file,
-            stderr=subprocess.PIPE
-        )
-
-        return process
+        return command
 
     def _split_schema(self):
         '''
@@ -1,4 +1,3 @@
-import shutil
 import sqlite3
 import subprocess
 
@@ -8,10 +7,8 @@ from agnostic import AbstractBackend
 class SqlLiteBackend(AbstractBackend):
     ''' Support for SQLite. '''
 
-    def __init__(self, *args):
-        super().__init__(*args)
-        self._param = '?'
-        self._now_fn = 'datetime()'
+    _param = '?'
+    _now_fn = 'datetime()'
 
     def backup_db(self, backup_file):
         '''
@@ -1,5 +1,6 @@
 import os
 import shutil
+import subprocess
 import tempfile
 import unittest
 from unittest.mock import MagicMock, patch
@@ -69,6 +70,43 @@ class TestCli(unittest.TestCase):
             'to do this?')
         self.assertNotEqual(result.exit_code, 0)
 
+    @patch('agnostic.cli.create_backend')
+    def test_tester_reads_snapshot_from_pipe(self, mock_create_backend):
+        backend = mock_create_backend.return_value
+        backend.get_schema_command.return_value = 'SELECT 1;\n'
+        backend.get_migration_names.return_value = []
+        backend.restore_db.return_value.returncode = 0
+        backend.restore_db.return_value.communicate.return_value = (None, b'')
+        snapshot_process = backend.snapshot_db.return_value
+        snapshot_process.returncode = 0
+        # CRLF line endings and a form feed must be read the same way as the
+        # text-mode target file reads them.
+        schema = (
+            b'CREATE TABLE foo;\n'
+            b"COMMENT ON TABLE foo IS 'page\x0cbreak';\n"
+            b'CREATE FUNCTION bar() RETURNS int AS $$\r\n'
+            b'SELECT 1;\r\n'
+            b'$$ LANGUAGE sql;\n'
+        )
+        snapshot_process.communicate.return_value = (
+            schema +
+            b"INSERT INTO agnostic_migrations VALUES ('1', 'bootstrapped');\n",
+            b''
+        )
+        backend.write_migration_inserts.side_effect = \
+            lambda cursor, outfile: outfile.write('SELECT 1;\n')
+        with open('current.sql', 'w') as current:
+            current.write('CREATE TABLE foo;\n')
+        with open('target.sql', 'wb') as target:
+            target.write(schema + b'SELECT 1;\n')
+        result = CliRunner().invoke(agnostic.cli.main,
+            ['-t', 'sqlite', '-d', 'test.db', '-m', self._migrations_dir,
+                'test', '-y', 'current.sql', 'target.sql'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Test passed', result.output)
+        backend.snapshot_db.assert_called_with(subprocess.PIPE)
+        snapshot_process.stdout.read.assert_not_called()
+
     def test_list_no_migrations(self):
         result = CliRunner().invoke(agnostic.cli.main,
             ['-t', 'sqlite', '-d', 'test.db', '-m', self._migrations_dir,
@@ -77,6 +115,7 @@ class TestCli(unittest.TestCase):
 
     def test_get_db_cursor_connect_error(self):
         config = MagicMock()
+        config.db = None
         config.debug = False
         config.backend.connect_db.side_effect = Exception()
         with self.assertRaises(ClickException):
@@ -85,21 +124,77 @@ class TestCli(unittest.TestCase):
 
     def test_get_db_cursor_schema_error(self):
         config = MagicMock()
+        config.db = None
         config.debug = False
         config.backend.get_schema_command.side_effect = Exception()
+        mock_db = config.backend.connect_db.return_value
         with self.assertRaises(ClickException):
             with agnostic.cli._get_db_cursor(config) as (db, cursor):
                 pass
+        mock_db.close.assert_called_with()
+        self.assertIsNone(config.db)
 
     def test_get_db_cursor_closes_automatically(self):
         config = MagicMock()
+        config.db = None
         config.debug = False
         with agnostic.cli._get_db_cursor(config) as (db, cursor):
             pass
+        cursor.close.assert_called_with()
+        db.close.assert_not_called()
+        # Swallows exception on cursor.close:
+        with agnostic.cli._get_db_cursor(config) as (db, cursor):
+            cursor.close.side_effect = Exception()
+
+    def test_get_db_cursor_reuses_connection(self):
+        config = MagicMock()
+        config.db = None
+        config.debug = False
+        with agnostic.cli._get_db_cursor(config) as (db1, cursor):
+            pass
+        with agnostic.cli._get_db_cursor(config) as (db2, cursor):
+            pass
+        self.assertIs(db1, db2)
+        config.backend.connect_db.assert_called_once_with()
+        config.backend.get_schema_command.assert_called_once_with()
+
+    def test_close_db(self):
+        config = MagicMock()
+        db = config.db
+        agnostic.cli._close_db(config)
         db.close.assert_called_with()
+        self.assertIsNone(config.db)
         # Swallows exception on db.close:
-        with agnostic.cli._get_db_cursor(config) as (db, cursor):
-            db.close.side_effect = Exception()
+        config.db = db
+        db.close.side_effect = Exception()
+        agnostic.cli._close_db(config)
+        self.assertIsNone(config.db)
+
+    @patch('agnostic.cli.logging')
+    def test_debug_enables_logging(self, mock_logging):
+        mock_logger = mock_logging.getLogger.return_value
+        mock_logger.handlers = []
+        CliRunner().invoke(agnostic.cli.main, ['-t', 'sqlite', '-d', 'test.db',
+            '-m', self._migrations_dir, '-D', 'list'])
+        mock_logging.getLogger.assert_called_with('agnostic')
+        mock_logger.setLevel.assert_called_with(mock_logging.DEBUG)
+        self.assertTrue(mock_logger.addHandler.called)
+
+    def test_wait_for(self):
+        process = MagicMock()
+        process.args = ['pg_dump']
+        process.returncode = 0
+        process.communicate.return_value = (b'output', b'')
+        self.assertEqual(agnostic.cli._wait_for(process), b'output')
+        process.communicate.assert_called_with()
+
+    def test_wait_for_error(self):
+        process = MagicMock()
+        process.args = ['pg_dump']
+        process.returncode = 1
+        process.communicate.return_value = (None, b'no such database')
+        with self.assertRaisesRegex(ClickException, 'no such database'):
+            agnostic.cli._wait_for(process)
 
     @patch('agnostic.cli._wait_for')
     def test_snapshot_error(self, mock_wait_for):
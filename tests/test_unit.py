@@ -1,3 +1,5 @@
+from datetime import datetime
+import io
 import logging
 import os
 import shutil
@@ -48,6 +50,61 @@ class TestUnit(unittest.TestCase):
             m = agnostic.Migration('1-my-name', 'bootstrapped',
                 started_at=b'2018-01-01 12:00:00')
 
+    def test_migration_datetime_from_str(self):
+        m = agnostic.Migration('1-my-name', 'succeeded',
+            started_at='2018-01-01 12:00:00',
+            completed_at='2018-01-01 12:00:01.25')
+        self.assertEqual(m.started_at, datetime(2018, 1, 1, 12, 0, 0))
+        self.assertEqual(m.completed_at,
+            datetime(2018, 1, 1, 12, 0, 1, 250000))
+
+    def test_bootstrap_migrations_in_batches(self):
+        be = agnostic.create_backend('sqlite', None, None, None, None,
+            'test.db', None)
+        mock_cursor = MagicMock()
+        names = ['{:03d}'.format(i) for i in range(401)]
+        be.bootstrap_migrations(mock_cursor, names)
+        self.assertEqual(mock_cursor.execute.call_count, 2)
+        first, second = mock_cursor.execute.call_args_list
+        self.assertEqual(len(first[0][1]), 800)
+        self.assertEqual(second[0][1], ['400', 'bootstrapped'])
+        self.assertEqual(second[0][0], 'INSERT INTO agnostic_migrations '
+            'VALUES (?, ?, datetime(), datetime())')
+
+    def test_write_migration_inserts_quotes_names(self):
+        be = agnostic.create_backend('sqlite', None, None, None, None,
+            'test.db', None)
+        mock_cursor = MagicMock()
+        mock_cursor.__iter__.return_value = iter([("1_it's",)])
+        outfile = io.StringIO()
+        be.write_migration_inserts(mock_cursor, outfile)
+        self.assertEqual(outfile.getvalue(), 'SELECT 1;\n'
+            "INSERT INTO agnostic_migrations VALUES ('1_it''s', 'succeeded', "
+            'datetime(), datetime());\n')
+
+    def test_migration_datetime_with_time_zone(self):
+        with self.assertRaises(ValueError):
+            agnostic.Migration('1-my-name', 'succeeded',
+                started_at='2018-01-01 12:00:00+00:00')
+
+    def test_has_failed_migrations(self):
+        be = agnostic.create_backend('sqlite', None, None, None, None,
+            'test.db', None)
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = (1,)
+        self.assertTrue(be.has_failed_migrations(mock_cursor))
+        query, params = mock_cursor.execute.call_args[0]
+        self.assertIn('status = ?', query)
+        self.assertNotIn('LIKE', query)
+        self.assertEqual(params, ('failed',))
+
+    def test_has_no_failed_migrations(self):
+        be = agnostic.create_backend('sqlite', None, None, None, None,
+            'test.db', None)
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = None
+        self.assertFalse(be.has_failed_migrations(mock_cursor))
+
     def test_mysql_backend(self):
         be = agnostic.create_backend('mysql', 'localhost', None, 'root',
             'password', 'testdb', None)
@@ -73,7 +130,7 @@ class TestUnit(unittest.TestCase):
             None, 'testdb', None)
         mock_getpass.assert_called_with('Enter password for "root" on "testdb":')
 
-    @patch('agnostic.mysql.subprocess')
+    @patch('agnostic.subprocess')
     def test_mysql_backup_with_port(self, mock_subprocess):
         be = agnostic.create_backend('mysql', 'localhost', 3307, 'root',
             'password', 'testdb', None)
@@ -100,7 +157,7 @@ class TestUnit(unittest.TestCase):
             'port': 3307,
         })
 
-    @patch('agnostic.mysql.subprocess')
+    @patch('agnostic.subprocess')
     def test_mysql_restore_with_port(self, mock_subprocess):
         be = agnostic.create_backend('mysql', 'localhost', 3307, 'root',
             'password', 'testdb', None)
@@ -112,7 +169,7 @@ class TestUnit(unittest.TestCase):
         self.assertIn('MYSQL_PWD', args[1]['env'])
         self.assertEqual(args[1]['env']['MYSQL_PWD'], 'password')
 
-    @patch('agnostic.mysql.subprocess')
+    @patch('agnostic.subprocess')
     def test_mysql_snapshot_with_port(self, mock_subprocess):
         be = agnostic.create_backend('mysql', 'localhost', 3307, 'root',
             'password', 'testdb', None)
@@ -154,7 +211,7 @@ class TestUnit(unittest.TestCase):
             None, 'testdb', None)
         mock_getpass.assert_called_with('Enter password for "root" on "testdb":')
 
-    @patch('agnostic.postgres.subprocess')
+    @patch('agnostic.subprocess')
     def test_postgres_backup_with_port(self, mock_subprocess):
         be = agnostic.create_backend('postgres', 'localhost', 5433, 'root',
             'password', 'testdb', None)
@@ -180,7 +237,7 @@ class TestUnit(unittest.TestCase):
             'port': 5433,
         })
 
-    @patch('agnostic.postgres.subprocess')
+    @patch('agnostic.subprocess')
     def test_postgres_restore_with_port(self, mock_subprocess):
         be = agnostic.create_backend('postgres', 'localhost', 5433, 'root',
             'password', 'testdb', None)
@@ -192,7 +249,7 @@ class TestUnit(unittest.TestCase):
         self.assertIn('PGPASSWORD', args[1]['env'])
         self.assertEqual(args[1]['env']['PGPASSWORD'], 'password')
 
-    @patch('agnostic.postgres.subprocess')
+    @patch('agnostic.subprocess')
     def test_postgres_snapshot_with_port(self, mock_subprocess):
         be = agnostic.create_backend('postgres', 'localhost', 5433, 'root',
             'password', 'testdb', None)
@@ -205,7 +262,7 @@ class TestUnit(unittest.TestCase):
         self.assertIn('PGPASSWORD', args[1]['env'])
         self.assertEqual(args[1]['env']['PGPASSWORD'], 'password')
 
-    @patch('agnostic.postgres.subprocess')
+    @patch('agnostic.subprocess')
     def test_postgres_backup_with_schema(self, mock_subprocess):
         be = agnostic.create_backend('postgres', 'localhost', None, 'root',
             'password', 'testdb', 'testschema')
@@ -232,7 +289,7 @@ class TestUnit(unittest.TestCase):
         cursor = db.cursor.return_value
         cursor.execute.assert_called_with("SET SCHEMA 'testschema'")
 
-    @patch('agnostic.postgres.subprocess')
+    @patch('agnostic.subprocess')
     def test_postgres_snapshot_with_schema(self, mock_subprocess):
         be = agnostic.create_backend('postgres', 'localhost', None, 'root',
             'password', 'testdb', '"$user",public')
@@ -254,6 +311,15 @@ class TestUnit(unittest.TestCase):
         mock_cursor.execute.assert_any_call(
             'DROP SCHEMA IF EXISTS schema1 CASCADE')
 
+    def test_postgres_clear_db_with_multiple_schemas(self):
+        be = agnostic.create_backend('postgres', 'localhost', None, 'root',
+            'password', 'testdb', 'schema1,public,schema2')
+        mock_cursor = MagicMock()
+        be.clear_db(mock_cursor)
+        self.assertEqual(mock_cursor.execute.call_count, 2)
+        mock_cursor.execute.assert_called_with(
+            'DROP SCHEMA IF EXISTS schema1, schema2 CASCADE')
+
     def test_sqlite_backend(self):
         be = agnostic.create_backend('sqlite', None, None, None, None,
             'test.db', None)